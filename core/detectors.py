@@ -1,36 +1,201 @@
+import codecs
+import copy
+import fnmatch
+import functools
+import os
+import re
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Any, Callable, Tuple
+from typing import Dict, Any, Callable, Iterator, Tuple
+
+
+# Каталоги, в которых детекторам искать нечего: служебные данные VCS,
+# установленные зависимости и виртуальные окружения, кэши и артефакты сборки.
+# build/ и env/ не пропускаем: в них часто лежит Dockerfile (build/package/Dockerfile),
+# а Docker перекрывает все остальные стеки.
+_SKIP_DIRS = frozenset({
+    ".git",
+    "node_modules", "vendor",
+    ".venv", "venv", ".tox",
+    "__pycache__", ".mypy_cache", ".pytest_cache",
+    "target", "dist",
+})
+
+# Glob-шаблоны детекторов известны заранее - компилируем их один раз при импорте.
+# При обходе дерева имя файла сначала проверяется объединённым выражением
+# _ANY_INTERESTING (одна проверка на запись), и только для совпавших имён
+# выясняется, какие конкретно шаблоны сработали.
+_DETECTOR_GLOBS = (
+    "requirements*.txt",
+    "*.gradle",
+    "*.gradle.kts",
+    "*.csproj",
+    "*.fsproj",
+    "deno.json*",
+    "import_map.json",
+    "*test*.py",
+)
+_PATTERN_TO_RE = {pattern: re.compile(fnmatch.translate(pattern)) for pattern in _DETECTOR_GLOBS}
+
+_ANY_INTERESTING = re.compile(
+    "(?:" + "|".join(f"(?:{fnmatch.translate(pattern)[:-2]})" for pattern in _DETECTOR_GLOBS) + r")\Z"
+)
+
+# Полный заголовок секции [tool.<name>...] или [[tool.<name>...]] в pyproject.toml:
+# допускаются BOM в начале файла, пробелы вокруг ключей и комментарий после "]".
+# Незакрытый заголовок ("[tool.uv" без "]") не засчитывается.
+_TOOL_HEADER = re.compile(
+    rb"^(?:\xef\xbb\xbf)?\s*\[\[?\s*tool\s*\.\s*([a-z0-9_-]+)\s*"
+    rb"(?:\.\s*[a-z0-9_-]+\s*)*\]\]?\s*(?:#.*)?$",
+    re.IGNORECASE,
+)
+
+
+@dataclass(slots=True, frozen=True)
+class RepoIndex:
+    """
+    Снимок структуры репозитория, собранный за один проход по дереву.
+
+    Все детекторы работают с этим индексом, а не с файловой системой напрямую,
+    поэтому дерево репозитория обходится ровно один раз на вызов detect_stack().
+    Индекс неизменяемый и хэшируемый (frozen + frozenset), атрибуты хранятся в __slots__.
+
+    Attributes:
+        repo: корневая директория репозитория
+        repo_str: тот же путь строкой - для os.path без создания объектов Path
+        root_files: имена файлов, лежащих непосредственно в корне
+        all_basenames: имена всех файлов во всём дереве
+        all_basenames_lower: те же имена в нижнем регистре (для регистронезависимых проверок)
+        has_tests: есть ли в проекте тесты - файл *test*.py или каталог tests/
+        matched_globs: шаблоны из _DETECTOR_GLOBS, под которые подошёл хотя бы один файл
+        pyproject_tools: инструменты из секций [tool.*] pyproject.toml (пусто - если файла нет)
+    """
+    repo: Path
+    repo_str: str
+    root_files: frozenset[str]
+    all_basenames: frozenset[str]
+    all_basenames_lower: frozenset[str]
+    matched_globs: frozenset[str]
+    pyproject_tools: frozenset[str]
+    has_tests: bool
+
 
-Detector = Callable[[Path], bool]
+Detector = Callable[[RepoIndex], bool]
 StackInfo = Tuple[str, str, Detector]  # (stack_name, template_name detector_func)
 
 
-def _has_file(repo: Path, pattern: str) -> bool:
+def _iter_entries(repo: Path, prune: frozenset[str] = _SKIP_DIRS) -> Iterator[os.DirEntry]:
+    """
+    Лениво обходит дерево репозитория через os.scandir и отдаёт записи файлов и каталогов.
+
+    Обход итеративный (явный стек вместо рекурсии), каталоги из prune
+    не отдаются и не посещаются, символические ссылки на каталоги не раскрываются.
+    Недоступные для чтения каталоги молча игнорируются.
+
+    Args:
+        repo (Path): корневая директория репозитория
+        prune (frozenset[str]): имена каталогов, в которые не нужно спускаться
+
+    Yields:
+        os.DirEntry: запись файла или каталога (тип закэширован в DirEntry, лишнего stat нет)
+    """
+    stack = [os.fspath(repo)]
+
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    # Ссылки на каталоги не раскрываем - это исключает циклы обхода
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in prune:
+                            continue
+                        stack.append(entry.path)
+                    yield entry
+        except OSError:
+            continue
+
+
+def _scan_repo(repo: Path) -> RepoIndex:
+    """
+    Один раз обходит дерево репозитория (_iter_entries) и строит RepoIndex.
+    Заодно однократно разбирает pyproject.toml, если он лежит в корне,
+    и отмечает наличие тестов (*test*.py или каталог tests/).
+
+    Args:
+        repo (Path): корневая директория репозитория
+
+    Returns:
+        RepoIndex: имена файлов и каталогов, собранные за один проход
+    """
+    root = os.fspath(repo)
+    root_files: set[str] = set()
+    basenames: set[str] = set()
+    has_tests_dir = False
+    matched: set[str] = set()
+
+    for entry in _iter_entries(repo):
+        name = entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if name == "tests":
+                has_tests_dir = True
+            continue
+        if not entry.is_file():
+            continue
+
+        basenames.add(name)
+        if os.path.dirname(entry.path) == root:
+            root_files.add(name)
+        if _ANY_INTERESTING.match(name):
+            for pattern, regex in _PATTERN_TO_RE.items():
+                if pattern not in matched and regex.match(name):
+                    matched.add(pattern)
+
+    return RepoIndex(
+        repo=repo,
+        repo_str=root,
+        root_files=frozenset(root_files),
+        all_basenames=frozenset(basenames),
+        all_basenames_lower=frozenset(name.lower() for name in basenames),
+        matched_globs=frozenset(matched),
+        pyproject_tools=(
+            _load_pyproject_tools(root) if "pyproject.toml" in root_files else frozenset()
+        ),
+        has_tests=has_tests_dir or "*test*.py" in matched,
+    )
+
+
+def _has_file(idx: RepoIndex, pattern: str) -> bool:
     """
     Проверяет, есть ли в репозитории хотя бы один файл, подходящий под glob-шаблон.
-    Поиск рекурсивный - проходит по всем подпапкам.
+    Поиск рекурсивный - по всему дереву, собранному в RepoIndex.
 
     Используется, когда файл может лежать в любой директории проекта
     (requirements-dev.txt, *.gradle.kts, Dockerfile в подпапке и т.п.).
 
     Args:
-        repo (Path): корневая директория репозитория
-        pattern (str): glob-шаблон для поиска
+        idx (RepoIndex): индекс репозитория, построенный _scan_repo()
+        pattern (str): glob-шаблон из _DETECTOR_GLOBS или точное имя файла
             - "requirements*.txt" - найдёт requirements.txt, requirements-dev.txt и др.
             - "*.gradle.kts" - найдёт все Kotlin Gradle-скрипты в любом месте
-            - "Dockerfile"     - точное имя тоже поддерживается
+            - "import_map.json" - точное имя проверяется по множеству имён
 
     Returns:
         bool: True - если найден хотя бы один файл по шаблону, иначе False
 
     Examples:
-        >>> _has_file(repo, "requirements*.txt")    # - True для pip-проектов
-        >>> _has_file(repo, "*.csproj")             # - True для .NET
+        >>> _has_file(idx, "requirements*.txt")    # - True для pip-проектов
+        >>> _has_file(idx, "*.csproj")             # - True для .NET
     """
-    return any(repo.rglob(pattern))
+    # Шаблоны детекторов уже сопоставлены с именами во время обхода
+    if pattern in _PATTERN_TO_RE:
+        return pattern in idx.matched_globs
+
+    # Точное имя - проверка по множеству, без регулярок
+    return pattern in idx.all_basenames
 
 
-def _file_exists(repo: Path, filename: str) -> bool:
+def _file_exists(idx: RepoIndex, filename: str) -> bool:
     """
     Проверяет наличие файла с точным именем строго в корне репозитория.
 
@@ -39,55 +204,105 @@ def _file_exists(repo: Path, filename: str) -> bool:
     Если файл лежит в подпапке - это обычно монорепо или ошибка - игнорируем.
 
     Args:
-        repo (Path): корневая директория репозитория
+        idx (RepoIndex): индекс репозитория, построенный _scan_repo()
         filename (str): точное имя файла (например: "package.json", "go.mod")
 
     Returns:
         bool: True - если файл существует в корне, иначе False
 
     Examples:
-        >>> _file_exists(repo, "package.json")   # - Node.js проект
-        >>> _file_exists(repo, "Cargo.toml")     # - Rust проект на Rust
+        >>> _file_exists(idx, "package.json")   # - Node.js проект
+        >>> _file_exists(idx, "Cargo.toml")     # - Rust проект на Rust
     """
-    return repo.joinpath(filename).is_file()
+    return filename in idx.root_files
 
 
-def _file_contains(repo: Path, filename: str, substring: str) -> bool:
+def _scan_pyproject_tools(repo_str: str) -> frozenset[str]:
     """
-    Безопасно читает файл из корня репозитория и проверяет,
-    содержится ли в нём указанная подстрока (нечувствительно к регистру).
+    Потоково читает pyproject.toml из корня репозитория и собирает имена инструментов
+    из заголовков секций [tool.<name>] (нечувствительно к регистру).
 
-    Основное применение - определение менеджера зависимостей в pyproject.toml:
-        [tool.poetry], [tool.uv], [tool.pdm] и т.п.
+    Файл читается в бинарном режиме построчно: в памяти держится только текущая строка,
+    нет декодирования UTF-8 и полной копии текста в нижнем регистре.
+    Заголовки вида [tool.poetry.dependencies], [[tool.uv.index]] и [ tool . uv ] тоже
+    учитываются, BOM в начале файла пропускается; незакрытые заголовки игнорируются.
 
     Защита от:
-        - битых кодировок (errors="ignore")
         - отсутствия файла
         - ошибок доступа / повреждений
 
     Args:
-        repo (Path): корневая директория репозитория
-        filename (str): имя файла в корне (например: "pyproject.toml")
-        substring (str): подстрока для поиска (например: "[tool.poetry]")
+        repo_str (str): корневая директория репозитория строкой (RepoIndex.repo_str)
+
+    Returns:
+        frozenset[str]: имена инструментов в нижнем регистре или пустое множество,
+            если файл прочитать не удалось
+
+    Examples:
+        >>> _scan_pyproject_tools(idx.repo_str)
+        frozenset({'poetry', 'ruff'})
+    """
+    tools: set[str] = set()
+    try:
+        with open(os.path.join(repo_str, "pyproject.toml"), "rb") as file:
+            for line in file:
+                match = _TOOL_HEADER.match(line)
+                if match:
+                    tools.add(match.group(1).decode("ascii").lower())
+    except OSError:
+        return frozenset()
+    return frozenset(tools)
+
+
+def _load_pyproject_tools(repo_str: str) -> frozenset[str]:
+    """
+    Разбирает pyproject.toml через tomllib и возвращает ключи таблицы [tool].
+
+    Это точнее поиска заголовков: учитываются только настоящие секции TOML,
+    а не совпадения в комментариях или строках. BOM в начале файла пропускается.
+    Если файл не удаётся разобрать
+    (битый TOML, байты не в UTF-8) или tomllib недоступен (Python < 3.11) - откатывается на
+    построчный поиск заголовков _scan_pyproject_tools().
+
+    Args:
+        repo_str (str): корневая директория репозитория строкой (RepoIndex.repo_str)
 
     Returns:
-        bool: True - если подстрока найдена в содержимом файла
+        frozenset[str]: имена инструментов в нижнем регистре
 
     Examples:
-        >>> _file_contains(repo, "pyproject.toml", "[tool.poetry]")  # - Poetry
-        >>> _file_contains(repo, "pyproject.toml", "[tool.uv]")      # - uv
+        >>> _load_pyproject_tools(idx.repo_str)
+        frozenset({'poetry', 'ruff'})
     """
-    path = repo.joinpath(filename)
-    if not path.is_file():
-        return False
+    # Импорт по месту: нужен только Python-проектам, не замедляет старт CLI
+    try:
+        import tomllib
+    except ModuleNotFoundError:  # Python < 3.11
+        return _scan_pyproject_tools(repo_str)
+
+    try:
+        with open(os.path.join(repo_str, "pyproject.toml"), "rb") as file:
+            raw = file.read()
+    except OSError:
+        return frozenset()
+
     try:
-        content = path.read_text(encoding="utf-8", errors="ignore")
-        return substring.lower() in content.lower()
-    except Exception:
-        return False
+        # tomllib не принимает BOM, а редакторы под Windows его часто добавляют
+        data = tomllib.loads(raw.removeprefix(codecs.BOM_UTF8).decode("utf-8"))
+    except (tomllib.TOMLDecodeError, UnicodeDecodeError):
+        # Битый TOML или байты не в UTF-8 - построчный поиск работает с байтами
+        return _scan_pyproject_tools(repo_str)
+
+    # Регистр ключей не учитываем - как и при поиске заголовков ([TOOL.UV] == [tool.uv])
+    return frozenset(
+        name.lower()
+        for key, table in data.items()
+        if key.lower() == "tool" and isinstance(table, dict)
+        for name in table
+    )
 
 
-def _pyproject_has_tool(repo: Path, tool_name: str) -> bool:
+def _pyproject_has_tool(idx: RepoIndex, tool_name: str) -> bool:
     """
     Проверяет, используется ли конкретный инструмент в pyproject.toml через секцию [tool.<tool_name>].
 
@@ -98,12 +313,11 @@ def _pyproject_has_tool(repo: Path, tool_name: str) -> bool:
         - [tool.hatch]   - Hatch
         - [tool.flit]    - Flit
 
-    Функция комбинирует два надёжных проверки:
-        1. Файл pyproject.toml есть в корне репозитория
-        2. Внутри файла есть нужная секция TOML (нечувствительно к регистру и пробелам)
+    pyproject.toml читается один раз при построении индекса (_scan_repo),
+    здесь проверяется только наличие инструмента среди уже собранных секций (нечувствительно к регистру).
 
     Args:
-        repo (Path): корневая директория репозитория
+        idx (RepoIndex): индекс репозитория, построенный _scan_repo()
         tool_name (str): имя инструмента в нижнем регистре, например:
             "poetry", "uv", "pdm", "hatch", "ruff", "black"
 
@@ -111,129 +325,131 @@ def _pyproject_has_tool(repo: Path, tool_name: str) -> bool:
         bool: True - если pyproject.toml существует и содержит секцию [tool.<tool_name>]
 
     Examples:
-        >>> _pyproject_has_tool(repo, "poetry")   # - True для Poetry-проектов
-        >>> _pyproject_has_tool(repo, "uv")       # - True для проектов на uv
-        >>> _pyproject_has_tool(repo, "pdm")      # - True для PDM
-        >>> _pyproject_has_tool(repo, "django")    # - False (нет такой секции)
+        >>> _pyproject_has_tool(idx, "poetry")   # - True для Poetry-проектов
+        >>> _pyproject_has_tool(idx, "uv")       # - True для проектов на uv
+        >>> _pyproject_has_tool(idx, "pdm")      # - True для PDM
+        >>> _pyproject_has_tool(idx, "django")    # - False (нет такой секции)
     """
-    return _file_exists(repo, "pyproject.toml") and _file_contains(
-        repo, "pyproject.toml", f"[tool.{tool_name}]"
-    )
+    return tool_name.lower() in idx.pyproject_tools
 
 # Детекторы стеков
-def _detect_docker(repo: Path) -> bool:
-    """Docker - максимальный приоритет, перекрывает всё"""
-    return _has_file(repo, "Dockerfile") or _has_file(repo, "dockerfile")
+def _detect_docker(idx: RepoIndex) -> bool:
+    """Docker - максимальный приоритет, перекрывает всё (имя Dockerfile в любом регистре)"""
+    return "dockerfile" in idx.all_basenames_lower
 
 
-def _detect_node_npm(repo: Path) -> bool:
+def _detect_node_npm(idx: RepoIndex) -> bool:
     """Node.js + npm - только если нет lock-файлов от yarn/pnpm/bun"""
-    return _file_exists(repo, "package.json") and not (
-        _file_exists(repo, "yarn.lock") or
-        _file_exists(repo, "pnpm-lock.yaml") or
-        _file_exists(repo, "bun.lockb")
+    return _file_exists(idx, "package.json") and not (
+        _file_exists(idx, "yarn.lock") or
+        _file_exists(idx, "pnpm-lock.yaml") or
+        _file_exists(idx, "bun.lockb")
     )
 
 
-def _detect_node_yarn(repo: Path) -> bool:
+def _detect_node_yarn(idx: RepoIndex) -> bool:
     """Node.js + Yarn"""
-    return _file_exists(repo, "yarn.lock")
+    return _file_exists(idx, "yarn.lock")
 
 
-def _detect_node_pnpm(repo: Path) -> bool:
+def _detect_node_pnpm(idx: RepoIndex) -> bool:
     """Node.js + pnpm"""
-    return _file_exists(repo, "pnpm-lock.yaml") or _file_exists(repo, "pnpm-workspace.yaml")
+    return _file_exists(idx, "pnpm-lock.yaml") or _file_exists(idx, "pnpm-workspace.yaml")
 
 
-def _detect_node_bun(repo: Path) -> bool:
+def _detect_node_bun(idx: RepoIndex) -> bool:
     """Node.js + Bun (самый быстрый в 2025–2026)"""
-    return _file_exists(repo, "bun.lockb")
+    return _file_exists(idx, "bun.lockb")
 
 
-def _detect_deno(repo: Path) -> bool:
+def _detect_deno(idx: RepoIndex) -> bool:
     """Deno"""
-    return _has_file(repo, "deno.json*") or _has_file(repo, "import_map.json")
+    return _has_file(idx, "deno.json*") or _has_file(idx, "import_map.json")
 
 
-def _detect_python_uv(repo: Path) -> bool:
+def _detect_python_uv(idx: RepoIndex) -> bool:
     """Python + uv - новый лидер 2025–2026"""
-    return _pyproject_has_tool(repo, "uv")
+    return _pyproject_has_tool(idx, "uv")
 
 
-def _detect_python_pdm(repo: Path) -> bool:
+def _detect_python_pdm(idx: RepoIndex) -> bool:
     """Python + PDM"""
-    return _pyproject_has_tool(repo, "pdm")
+    return _pyproject_has_tool(idx, "pdm")
 
 
-def _detect_python_poetry(repo: Path) -> bool:
+def _detect_python_poetry(idx: RepoIndex) -> bool:
     """Python + Poetry"""
-    return _pyproject_has_tool(repo, "poetry")
+    return _pyproject_has_tool(idx, "poetry")
 
 
-def _detect_python_pipenv(repo: Path) -> bool:
+def _detect_python_pipenv(idx: RepoIndex) -> bool:
     """Python + Pipenv"""
-    return _file_exists(repo, "Pipfile") or _file_exists(repo, "Pipfile.lock")
+    return _file_exists(idx, "Pipfile") or _file_exists(idx, "Pipfile.lock")
 
 
-def _detect_python_pip(repo: Path) -> bool:
+def _detect_python_pip(idx: RepoIndex) -> bool:
     """Классический Python (pip + requirements*.txt / setup.py)"""
     return (
-        _has_file(repo, "requirements*.txt") or
-        _file_exists(repo, "setup.py") or
-        _file_exists(repo, "setup.cfg")
+        _has_file(idx, "requirements*.txt") or
+        _file_exists(idx, "setup.py") or
+        _file_exists(idx, "setup.cfg")
     )
 
 
-def _detect_go(repo: Path) -> bool:
+def _detect_go(idx: RepoIndex) -> bool:
     """Go"""
-    return _file_exists(repo, "go.mod")
+    return _file_exists(idx, "go.mod")
 
 
-def _detect_rust(repo: Path) -> bool:
+def _detect_rust(idx: RepoIndex) -> bool:
     """Rust + Cargo"""
-    return _file_exists(repo, "Cargo.toml")
+    return _file_exists(idx, "Cargo.toml")
 
 
-def _detect_java_maven(repo: Path) -> bool:
+def _detect_java_maven(idx: RepoIndex) -> bool:
     """Java/Kotlin + Maven"""
-    return _file_exists(repo, "pom.xml")
+    return _file_exists(idx, "pom.xml")
 
 
-def _detect_java_gradle(repo: Path) -> bool:
+def _detect_java_gradle(idx: RepoIndex) -> bool:
     """Java/Kotlin + Gradle (включая Kotlin DSL)"""
     return (
-        _has_file(repo, "*.gradle") or
-        _has_file(repo, "*.gradle.kts") or
-        _file_exists(repo, "gradlew") or
-        _file_exists(repo, "settings.gradle.kts")
+        _has_file(idx, "*.gradle") or
+        _has_file(idx, "*.gradle.kts") or
+        _file_exists(idx, "gradlew") or
+        _file_exists(idx, "settings.gradle.kts")
     )
 
 
-def _detect_dotnet(repo: Path) -> bool:
+def _detect_dotnet(idx: RepoIndex) -> bool:
     """.NET (C#/F#)"""
-    return _has_file(repo, "*.csproj") or _has_file(repo, "*.fsproj")
+    return _has_file(idx, "*.csproj") or _has_file(idx, "*.fsproj")
 
 
-def _detect_php_composer(repo: Path) -> bool:
+def _detect_php_composer(idx: RepoIndex) -> bool:
     """PHP + Composer"""
-    return _file_exists(repo, "composer.json")
+    return _file_exists(idx, "composer.json")
 
 
-def _detect_elixir(repo: Path) -> bool:
+def _detect_elixir(idx: RepoIndex) -> bool:
     """Elixir + Mix"""
-    return _file_exists(repo, "mix.exs")
+    return _file_exists(idx, "mix.exs")
 
 
-def _detect_ruby(repo: Path) -> bool:
+def _detect_ruby(idx: RepoIndex) -> bool:
     """Ruby + Bundler"""
-    return _file_exists(repo, "Gemfile")
+    return _file_exists(idx, "Gemfile")
 
 
-def _detect_flutter(repo: Path) -> bool:
+def _detect_flutter(idx: RepoIndex) -> bool:
     """Flutter / Dart"""
-    return _file_exists(repo, "pubspec.yaml")
+    return _file_exists(idx, "pubspec.yaml")
 
 
+# Порядок списка - только смысловой приоритет стеков, а не стоимость проверок:
+# все детекторы работают по RepoIndex за O(1), рекурсивный обход дерева
+# делается один раз в _scan_repo() независимо от того, какой детектор сработает.
+# Поэтому Docker остаётся первым и по-прежнему перекрывает остальные стеки.
 STACK_PRIORITY: list[StackInfo] = [
     ("docker",          "docker.yml.j2",          _detect_docker),
 
@@ -263,7 +479,155 @@ STACK_PRIORITY: list[StackInfo] = [
 ]
 
 
-def _build_context(repo: Path, stack: str) -> Dict[str, Any]:
+def _ctx_docker(idx: RepoIndex) -> Dict[str, Any]:
+    """Docker"""
+    return {"build_cmd": "docker build -t ${{ steps.meta.outputs.tags }} ."}
+
+
+def _ctx_node_npm(idx: RepoIndex) -> Dict[str, Any]:
+    """Node.js + npm: шаги build/test - только если есть такие scripts в package.json"""
+    import json
+
+    # Смотрим только на секцию "scripts": зависимость с именем "build" не должна
+    # включать шаг сборки. Битый или нечитаемый package.json - как будто скриптов нет.
+    try:
+        with open(os.path.join(idx.repo_str, "package.json"), "rb") as file:
+            pkg = json.load(file)
+        scripts = pkg.get("scripts") if isinstance(pkg, dict) else None
+    except (OSError, ValueError):
+        scripts = None
+    if not isinstance(scripts, dict):
+        scripts = {}
+
+    return {
+        "install_cmd": "npm ci --prefer-offline",
+        "build_cmd": "npm run build" if "build" in scripts else None,
+        "test_cmd": "npm test" if "test" in scripts else None,
+    }
+
+
+def _ctx_node_yarn(idx: RepoIndex) -> Dict[str, Any]:
+    """Node.js + Yarn"""
+    return {"install_cmd": "yarn install --frozen-lockfile"}
+
+
+def _ctx_node_pnpm(idx: RepoIndex) -> Dict[str, Any]:
+    """Node.js + pnpm"""
+    return {"install_cmd": "pnpm i --frozen-lockfile"}
+
+
+def _ctx_node_bun(idx: RepoIndex) -> Dict[str, Any]:
+    """Node.js + Bun"""
+    return {"install_cmd": "bun install --frozen-lockfile"}
+
+
+def _ctx_deno(idx: RepoIndex) -> Dict[str, Any]:
+    """Deno"""
+    return {"install_cmd": "deno cache main.ts", "test_cmd": "deno test"}
+
+
+def _ctx_python_uv(idx: RepoIndex) -> Dict[str, Any]:
+    """Python + uv: pytest - только если в проекте есть тесты"""
+    return {
+        "install_cmd": "uv sync --frozen",
+        "test_cmd": "uv run pytest" if idx.has_tests else None,
+        "build_cmd": "uv build" if "uv" in idx.pyproject_tools else None,
+    }
+
+
+def _ctx_python_pdm(idx: RepoIndex) -> Dict[str, Any]:
+    """Python + PDM"""
+    return {"install_cmd": "pdm sync --no-editable", "test_cmd": "pdm run pytest"}
+
+
+def _ctx_python_poetry(idx: RepoIndex) -> Dict[str, Any]:
+    """Python + Poetry"""
+    return {
+        "install_cmd": "poetry install --no-interaction --no-root",
+        "build_cmd": "poetry build",
+        "test_cmd": "poetry run pytest",
+    }
+
+
+def _ctx_python_pipenv(idx: RepoIndex) -> Dict[str, Any]:
+    """Python + Pipenv"""
+    return {"install_cmd": "pipenv install --deploy --ignore-pipfile"}
+
+
+def _ctx_python_pip(idx: RepoIndex) -> Dict[str, Any]:
+    """Классический Python (pip + requirements.txt)"""
+    return {"install_cmd": "pip install -r requirements.txt"}
+
+
+def _ctx_go(idx: RepoIndex) -> Dict[str, Any]:
+    """Go"""
+    return {
+        "install_cmd": "go mod download",
+        "build_cmd": "go build -o app .",
+        "test_cmd": "go test ./...",
+    }
+
+
+def _ctx_rust(idx: RepoIndex) -> Dict[str, Any]:
+    """Rust + Cargo"""
+    return {"build_cmd": "cargo build --release", "test_cmd": "cargo test"}
+
+
+def _ctx_dotnet(idx: RepoIndex) -> Dict[str, Any]:
+    """.NET (C#/F#)"""
+    return {
+        "install_cmd": "dotnet restore",
+        "build_cmd": "dotnet publish -c Release -o out",
+        "artifact_path": "out",
+    }
+
+
+def _ctx_php_composer(idx: RepoIndex) -> Dict[str, Any]:
+    """PHP + Composer"""
+    return {"install_cmd": "composer install --no-dev --optimize-autoloader"}
+
+
+def _ctx_elixir(idx: RepoIndex) -> Dict[str, Any]:
+    """Elixir + Mix"""
+    return {"install_cmd": "mix deps.get", "test_cmd": "mix test"}
+
+
+def _ctx_ruby(idx: RepoIndex) -> Dict[str, Any]:
+    """Ruby + Bundler"""
+    return {"install_cmd": "bundle install --frozen"}
+
+
+def _ctx_flutter(idx: RepoIndex) -> Dict[str, Any]:
+    """Flutter / Dart"""
+    return {"install_cmd": "flutter pub get", "build_cmd": "flutter build apk --release"}
+
+
+_CTX_BUILDERS: Dict[str, Callable[[RepoIndex], Dict[str, Any]]] = {
+    "docker":           _ctx_docker,
+
+    "node-npm":         _ctx_node_npm,
+    "node-yarn":        _ctx_node_yarn,
+    "node-pnpm":        _ctx_node_pnpm,
+    "node-bun":         _ctx_node_bun,
+    "deno":             _ctx_deno,
+
+    "python-uv":        _ctx_python_uv,
+    "python-pdm":       _ctx_python_pdm,
+    "python-poetry":    _ctx_python_poetry,
+    "python-pipenv":    _ctx_python_pipenv,
+    "python-pip":       _ctx_python_pip,
+
+    "go":               _ctx_go,
+    "rust":             _ctx_rust,
+    "dotnet":           _ctx_dotnet,
+    "php-composer":     _ctx_php_composer,
+    "elixir":           _ctx_elixir,
+    "ruby":             _ctx_ruby,
+    "flutter":          _ctx_flutter,
+}
+
+
+def _build_context(idx: RepoIndex, stack: str, has_docker: bool) -> Dict[str, Any]:
     """
     Формирует контекст для Jinja2-шаблона - словарь с командами сборки, тестирования и метаданными,
     специфичными для определённого технологического стека.
@@ -282,14 +646,15 @@ def _build_context(repo: Path, stack: str) -> Dict[str, Any]:
     Поддерживаемые стеки и их команды актуальны на 2025–2026 год.
 
     Args:
-        repo (Path): путь к корню репозитория
+        idx (RepoIndex): индекс репозитория, построенный _scan_repo()
         stack (str): идентификатор стека, например: "python-poetry", "node-bun", "go"
+        has_docker (bool): результат _detect_docker(), уже посчитанный в detect_stack()
 
     Returns:
         Dict[str, Any]: контекст для рендеринга GitHub Actions workflow через Jinja2
 
     Examples:
-        >>> _build_context(repo, "python-uv")
+        >>> _build_context(idx, "python-uv", False)
         {
             'project_name': 'my-api',
             'has_docker': False,
@@ -300,9 +665,10 @@ def _build_context(repo: Path, stack: str) -> Dict[str, Any]:
             'artifact_path': None
         }
     """
+    repo = idx.repo
     ctx: Dict[str, Any] = {
         "project_name": repo.name.lower().replace(" ", "-").replace("_", "-"),
-        "has_docker": _detect_docker(repo),
+        "has_docker": has_docker,
         "docker_tag": f"{repo.name.lower()}:latest",
         "install_cmd": None,
         "build_cmd": None,
@@ -310,83 +676,74 @@ def _build_context(repo: Path, stack: str) -> Dict[str, Any]:
         "artifact_path": None,
     }
 
-    match stack:
-        case "docker":
-            ctx["build_cmd"] = "docker build -t ${{ steps.meta.outputs.tags }} ."
+    builder = _CTX_BUILDERS.get(stack)
+    if builder is not None:
+        ctx.update(builder(idx))
 
-        case "node-npm":
-            ctx["install_cmd"] = "npm ci --prefer-offline"
-            pkg_content = (repo / "package.json").read_text(encoding="utf-8", errors="ignore")
-            ctx["build_cmd"] = "npm run build" if '"build"' in pkg_content else None
-            ctx["test_cmd"] = "npm test" if '"test"' in pkg_content else None
-
-        case "node-yarn":
-            ctx["install_cmd"] = "yarn install --frozen-lockfile"
-        case "node-pnpm":
-            ctx["install_cmd"] = "pnpm i --frozen-lockfile"
-        case "node-bun":
-            ctx["install_cmd"] = "bun install --frozen-lockfile"
-
-        case "deno":
-            ctx["install_cmd"] = "deno cache main.ts"
-            ctx["test_cmd"] = "deno test"
-
-        case "python-uv":
-            ctx["install_cmd"] = "uv sync --frozen"
-            ctx["test_cmd"] = "uv run pytest" if _has_file(repo, "*test*.py") or _has_file(repo, "tests/") else None
-            ctx["build_cmd"] = "uv build" if _pyproject_has_tool(repo, "uv") else None
-
-        case "python-pdm":
-            ctx["install_cmd"] = "pdm sync --no-editable"
-            ctx["test_cmd"] = "pdm run pytest"
-
-        case "python-poetry":
-            ctx["install_cmd"] = "poetry install --no-interaction --no-root"
-            ctx["build_cmd"] = "poetry build"
-            ctx["test_cmd"] = "poetry run pytest"
-
-        case "python-pipenv":
-            ctx["install_cmd"] = "pipenv install --deploy --ignore-pipfile"
-
-        case "python-pip":
-            ctx["install_cmd"] = "pip install -r requirements.txt"
+    return ctx
 
-        case "go":
-            ctx["install_cmd"] = "go mod download"
-            ctx["build_cmd"] = "go build -o app ."
-            ctx["test_cmd"] = "go test ./..."
 
-        case "rust":
-            ctx["build_cmd"] = "cargo build --release"
-            ctx["test_cmd"] = "cargo test"
+# Манифесты в корне, содержимое которых влияет на результат detect_stack()
+_CACHE_MANIFESTS = ("pyproject.toml", "package.json")
 
-        case "dotnet":
-            ctx["install_cmd"] = "dotnet restore"
-            ctx["build_cmd"] = "dotnet publish -c Release -o out"
-            ctx["artifact_path"] = "out"
 
-        case "php-composer":
-            ctx["install_cmd"] = "composer install --no-dev --optimize-autoloader"
+def _cache_mtimes(path_str: str) -> Tuple[int | None, ...]:
+    """
+    Возвращает mtime (в наносекундах) корня репозитория и манифестов из _CACHE_MANIFESTS.
+    Редактирование файла на месте mtime корня не меняет, поэтому манифесты,
+    которые детекторы читают, учитываются отдельно. Отсутствующий файл - None.
+    """
+    mtimes: list[int | None] = [os.stat(path_str).st_mtime_ns]
+    for filename in _CACHE_MANIFESTS:
+        try:
+            mtimes.append(os.stat(os.path.join(path_str, filename)).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
 
-        case "elixir":
-            ctx["install_cmd"] = "mix deps.get"
-            ctx["test_cmd"] = "mix test"
 
-        case "ruby":
-            ctx["install_cmd"] = "bundle install --frozen"
+@functools.lru_cache(maxsize=32)
+def _detect_stack_cached(path_str: str, mtimes_ns: Tuple[int | None, ...]) -> Dict[str, Any]:
+    """
+    Кэшируемая часть detect_stack(): mtimes_ns (см. _cache_mtimes) входят в ключ кэша,
+    чтобы изменения в корне репозитория и в читаемых манифестах инвалидировали старый результат.
+    """
+    repo_path = Path(path_str)
+    idx = _scan_repo(repo_path)
+    # Наличие Dockerfile нужно и детектору, и контексту - считаем один раз
+    has_docker = _detect_docker(idx)
 
-        case "flutter":
-            ctx["install_cmd"] = "flutter pub get"
-            ctx["build_cmd"] = "flutter build apk --release"
+    for stack_name, template_name, detector in STACK_PRIORITY:
+        matched = has_docker if detector is _detect_docker else detector(idx)
+        if matched:
+            return {
+                "stack": stack_name,
+                "template": template_name,
+                "context": _build_context(idx, stack_name, has_docker),
+            }
 
-    return ctx
+    # Fallback - репозиторий не опознан
+    return {
+        "stack": "unknown",
+        "template": "unknown.yml.j2",
+        "context": {
+            "project_name": repo_path.name.lower().replace(" ", "-"),
+            "has_docker": has_docker,
+            "docker_tag": f"{repo_path.name.lower()}:latest",
+            "install_cmd": None,
+            "build_cmd": None,
+            "test_cmd": None,
+            "artifact_path": None,
+        },
+    }
 
 
 def detect_stack(repo_path: Path) -> Dict[str, Any]:
     """
     Основная функция детектора: анализирует репозиторий и определяет его технологический стек.
 
-    Проходит по списку приоритетов (STACK_PRIORITY) сверху вниз.
+    Один раз обходит дерево репозитория (_scan_repo), затем проходит по списку
+    приоритетов (STACK_PRIORITY) сверху вниз - детекторы проверяются по индексу в памяти.
     Как только находит подходящий стек - сразу возвращает полные данные для генерации GitHub Actions workflow.
     Dockerfile имеет наивысший приоритет и перекрывает все остальные стеки.
 
@@ -397,6 +754,17 @@ def detect_stack(repo_path: Path) -> Dict[str, Any]:
 
     Если ничего не подошёл ни один детектор - возвращается безопасный fallback "unknown".
 
+    Результат кэшируется по абсолютному пути и mtime корня репозитория и манифестов,
+    содержимое которых читается (pyproject.toml, package.json), поэтому повторные
+    вызовы для неизменённого репозитория не обходят дерево заново.
+    mtime корня меняется только при добавлении/удалении/переименовании записей
+    в самом корне. Изменения во вложенных каталогах (например, новый
+    sub/Dockerfile) в ключ не попадают - после них сбросить кэш можно через
+    detect_stack.cache_clear().
+    Путь делается абсолютным без раскрытия символических ссылок, поэтому
+    project_name и docker_tag берутся из имени, переданного вызывающим кодом.
+    Каждый вызов возвращает независимую копию результата.
+
     Args:
         repo_path (Path): абсолютный или относительный путь до корня репозитория
                           (должен существовать и быть директорией)
@@ -432,25 +800,10 @@ def detect_stack(repo_path: Path) -> Dict[str, Any]:
     if not repo_path.is_dir():
         raise ValueError(f"Путь {repo_path} не существует или не является директорией")
 
-    for stack_name, template_name, detector in STACK_PRIORITY:
-        if detector(repo_path):
-            return {
-                "stack": stack_name,
-                "template": template_name,
-                "context": _build_context(repo_path, stack_name),
-            }
+    path_str = os.path.abspath(repo_path)
+    cached = _detect_stack_cached(path_str, _cache_mtimes(path_str))
+    # Копия - чтобы вызывающий код не мог испортить закэшированный контекст
+    return copy.deepcopy(cached)
 
-    # Fallback - репозиторий не опознан
-    return {
-        "stack": "unknown",
-        "template": "unknown.yml.j2",
-        "context": {
-            "project_name": repo_path.name.lower().replace(" ", "-"),
-            "has_docker": _detect_docker(repo_path),
-            "docker_tag": f"{repo_path.name.lower()}:latest",
-            "install_cmd": None,
-            "build_cmd": None,
-            "test_cmd": None,
-            "artifact_path": None,
-        },
-    }
\ No newline at end of file
+
+detect_stack.cache_clear = _detect_stack_cached.cache_clear
@@ -1,6 +1,18 @@
+import fnmatch
+import os
+import re
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 
+# Каталоги, которые не нужно обходить при поиске env-файлов: служебные данные git
+# и установленные зависимости. Артефакты сборки (dist/, target/ и т.п.) обходим -
+# их тоже коммитят, и секрет в них должен попасть в отчёт.
+_SKIP_DIRS = {".git", "node_modules"}
+
+# Шаблоны опасных файлов (нельзя коммитить) и файлов-примеров
+_DANGER_PATTERNS = [re.compile(fnmatch.translate(p)) for p in ("*.env", "*.env.*[!example]")]
+_EXAMPLE_PATTERNS = [re.compile(fnmatch.translate(p)) for p in ("*.env.example", "*.env.*.example")]
+
 def find_env_files(repo_path: Path) -> Dict[str, Any] :
     """
         Находит файлы, которые согласно безопасности не должны быть в репозитории
@@ -21,21 +33,25 @@ def find_env_files(repo_path: Path) -> Dict[str, Any] :
     example_files: List[Path] = []
     variables: Dict[str, Dict[str, str]] = {}
     result: Dict[str, Any] = {}
-    # Список опасных шаблонов файлов
-    danger_patterns: List[str] = ["*.env", "*.env.*[!example]"]
-    # Список шаблонов example файлов
-    example_patterns: List[str] = ["*.env.example", "*.env.*.example"]
 
-    for pattern in danger_patterns:
-        danger += list(Path(repo_path).rglob(pattern))
+    # Один проход по дереву, имена сверяются с шаблонами в памяти
+    for dirpath, dirnames, filenames in os.walk(repo_path):
+        dirnames[:] = [name for name in dirnames if name not in _SKIP_DIRS]
+        for name in filenames:
+            if any(regex.match(name) for regex in _DANGER_PATTERNS):
+                danger.append(Path(dirpath, name))
+            elif any(regex.match(name) for regex in _EXAMPLE_PATTERNS):
+                example_files.append(Path(dirpath, name))
     result["danger"] = danger
-
-    for pattern in example_patterns:
-        example_files += list(Path(repo_path).rglob(pattern))
     result["example"] = example_files
 
-    for file in example_files:
-        variables[file.name] = parse_env_example(file)
+    # Чтение мелких файлов упирается в задержки I/O - разбираем их параллельно в потоках
+    if example_files:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(32, len(example_files))) as executor:
+            parsed = executor.map(parse_env_example, example_files)
+            variables = dict(zip((file.name for file in example_files), parsed))
     result["variables"] = variables
 
     return result
@@ -48,26 +64,29 @@ def parse_env_example(example_path: Optional[Path]) -> Dict[str, str]:
         example_path: Путь к файлу env.example
 
     Returns:
-        Словарь вида `Key` - `Value`
+        Словарь вида `Key` - `Value`; пустой, если файл не удалось прочитать
     """
 
     env_vars: Dict[str, str] = {}
+    if example_path is None:
+        return env_vars
     try:
-        with open(example_path, "r", encoding="utf-8") as file:
-            for line in file:
-                line = line.strip()
-                # Пропускаем пустые строки и комментарии
-                if not line or line.startswith("#"):
-                    continue
-
-                # Разделяем по первому знаку "="
-                if "=" in line:
-                    key, value = line.split("=", 1)
-                    env_vars[key.strip()] = value.strip()
-    except FileNotFoundError:
-        print(f"Error: File {example_path} not found.")
-    except Exception as e:
-        print(f"Error reading file: {e}")
+        # Читаем байты одним вызовом: строки разбираются без UTF-8 декодера,
+        # декодируются только итоговые ключи и значения
+        data = Path(example_path).read_bytes()
+    except OSError:
+        return env_vars
+
+    for line in data.splitlines():
+        line = line.strip()
+        # Пропускаем пустые строки и комментарии
+        if not line or line.startswith(b"#"):
+            continue
+
+        # Разделяем по первому знаку "="
+        key, sep, value = line.partition(b"=")
+        if sep:
+            env_vars[key.strip().decode("utf-8", "replace")] = value.strip().decode("utf-8", "replace")
 
     return env_vars
 
@@ -82,11 +101,10 @@ def clean_repo_name(path: Path):
     if path.is_file():
         path.unlink(missing_ok=True)
     elif path.is_dir():
-        # Рекурсивно удаляем все содержимое
-        for item in path.iterdir():
-            clean_repo_name(item)
-        # Удаляем саму директорию
-        path.rmdir()
+        import shutil
+
+        # Обход и удаление целиком делает shutil (os.scandir + unlink/rmdir)
+        shutil.rmtree(path, ignore_errors=True)
 
 def get_repo_name(source: str | Path) -> str:
     """
@@ -100,14 +118,17 @@ def get_repo_name(source: str | Path) -> str:
     """
 
     if isinstance(source, Path):
-        return source.name.replace(".git", "") if source.name else "unknown-repo"
-    elif isinstance(source, str):
-        src = source.replace("\\", "/")
-        if src.startswith("git@") or src.startswith("http") or src.startswith("https"):
-            return src.replace(".git", "").split(':')[-1].split('/')[-1]
-        elif '/' in src or ".git" in src:
-            return src.replace(".git", "").split('/')[-1]
-        else:
-            return "unknown-repo"
-    else:
-        return "unknown-repo"
\ No newline at end of file
+        return source.name.removesuffix(".git") or "unknown-repo"
+    if not isinstance(source, str):
+        return "unknown-repo"
+
+    src = source.replace("\\", "/")
+    is_remote = src.startswith(("git@", "http"))
+    if not (is_remote or "/" in src or ".git" in src):
+        return "unknown-repo"
+
+    # Последний сегмент пути; у git@host:org/repo имя может идти сразу после ":"
+    name = src.removesuffix(".git").rpartition("/")[2]
+    if is_remote:
+        name = name.rpartition(":")[2]
+    return name or "unknown-repo"
\ No newline at end of file